@@ -1,26 +1,48 @@
 import boto3
+from botocore.config import Config
 import os
+import argparse
+import functools
+import hashlib
 import time
 import json
-from PIL import Image
+import cv2
 import numpy as np
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def start_model(project_arn, model_arn, version_name, min_inference_units):
-    client = boto3.client('rekognition')
+def start_model(client, project_arn, model_arn, version_name, min_inference_units):
     try:
-        print('Starting model: ' + model_arn)
-        response = client.start_project_version(
-            ProjectVersionArn=model_arn,
-            MinInferenceUnits=min_inference_units
-        )
+        # Skip start and waiter round-trips when the model is already warm
+        response = client.describe_project_versions(ProjectArn=project_arn, VersionNames=[version_name])
+        status = response['ProjectVersionDescriptions'][0]['Status']
+        if status == 'RUNNING':
+            print('✅ Model is already running.')
+            return
+
+        if status != 'STARTING':
+            print('Starting model: ' + model_arn)
+            response = client.start_project_version(
+                ProjectVersionArn=model_arn,
+                MinInferenceUnits=min_inference_units
+            )
         project_version_running_waiter = client.get_waiter('project_version_running')
-        project_version_running_waiter.wait(ProjectArn=project_arn, VersionNames=[version_name])
+        project_version_running_waiter.wait(
+            ProjectArn=project_arn,
+            VersionNames=[version_name],
+            WaiterConfig={'Delay': 5, 'MaxAttempts': 120}
+        )
         print('✅ Model is running.')
     except Exception as e:
         print('❌ Error starting model:', e)
 
-rekognition_client = boto3.client('rekognition')
+MAX_WORKERS = 16
+
+@functools.lru_cache(maxsize=None)
+def get_rekognition_client():
+    # boto3 clients are thread-safe; size the connection pool for the worker threads
+    return boto3.session.Session().client(
+        'rekognition', config=Config(max_pool_connections=2 * MAX_WORKERS)
+    )
 
 def detect_custom_labels(client, model_arn, image_bytes):
     try:
@@ -31,107 +53,193 @@ def detect_custom_labels(client, model_arn, image_bytes):
         return response['CustomLabels']
     except Exception as e:
         print('❌ Detection error:', e)
-        return []
-
-def process_pallets_and_sheets(image_path, bounding_boxes, pixel_threshold_min=20, pixel_threshold_max=30):
-    image = Image.open(image_path).convert('L')  # Convert to grayscale
-    np_image = np.array(image)
-    img_width, img_height = image.size
-
-    pallets = []
-
-    for i, bbox in enumerate(bounding_boxes):      
-        left = int(bbox['Left'] * img_width)
-        top = int(bbox['Top'] * img_height)
-        width = int(bbox['Width'] * img_width)
-        height = int(bbox['Height'] * img_height)
+        return None  # distinguishes a failed call from an image without labels
 
-        cropped = np_image[top:top+height, left:left+width]
-
-        white_pixels = np.sum(cropped > 200)
-
-        sheet_detected = None
-        if pixel_threshold_min <= white_pixels <= pixel_threshold_max:
-            sheet_detected = {
-                'sheet_left': left,
-                'sheet_top': top,
-                'sheet_width': width,
-                'sheet_height': height,
-                'white_pixels': white_pixels
-            }
+def _slice_bounds(starts, stops, size):
+    # Vectorized Python slice semantics: negative bounds count from the end, empty if stop <= start
+    starts = np.clip(np.where(starts < 0, starts + size, starts), 0, size)
+    stops = np.clip(np.where(stops < 0, stops + size, stops), starts, size)
+    return starts, stops
 
-        pallet_info = {
+def process_pallets_and_sheets(image_path, bounding_boxes, pixel_threshold_min=20, pixel_threshold_max=30):
+    # Keep raw pixel orientation like PIL did. Decode in colour and convert with cvtColor:
+    # IMREAD_GRAYSCALE rounds luma differently from PIL's convert('L'), cvtColor matches it
+    np_image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if np_image is None:
+        raise IOError(f"Could not read image: {image_path}")
+    np_image = cv2.cvtColor(np_image, cv2.COLOR_BGR2GRAY)
+    img_height, img_width = np_image.shape
+
+    # Integral image of white pixels (> 200): any box sum becomes four lookups
+    _, white_mask = cv2.threshold(np_image, 200, 1, cv2.THRESH_BINARY)
+    white = cv2.integral(white_mask)
+
+    boxes = np.array([
+        [bbox['Left'], bbox['Top'], bbox['Width'], bbox['Height']]
+        for bbox in bounding_boxes
+    ], dtype=np.float64).reshape(-1, 4)
+    scale = np.array([img_width, img_height, img_width, img_height], dtype=np.float64)
+    lefts, tops, widths, heights = (boxes * scale).astype(np.int64).T
+
+    # Resolve bounds exactly like np_image[top:top+height, left:left+width] would
+    l, r = _slice_bounds(lefts, lefts + widths, img_width)
+    t, b = _slice_bounds(tops, tops + heights, img_height)
+    white_counts = white[b, r] - white[t, r] - white[b, l] + white[t, l]
+
+    return [
+        {
             'pallet_index': i,
             'pallet_left': left,
             'pallet_top': top,
             'pallet_width': width,
             'pallet_height': height,
-            'sheet_detected': sheet_detected
+            'sheet_detected': {
+                'sheet_left': left,
+                'sheet_top': top,
+                'sheet_width': width,
+                'sheet_height': height,
+                'white_pixels': white_pixels
+            } if pixel_threshold_min <= white_pixels <= pixel_threshold_max else None
         }
+        for i, (left, top, width, height, white_pixels) in enumerate(zip(
+            lefts.tolist(), tops.tolist(), widths.tolist(), heights.tolist(), white_counts.tolist()
+        ))
+    ]
 
-        pallets.append(pallet_info)
-
-    return pallets
+JPEG_QUALITY = 75
 
 def resize_image_if_needed(image_path, max_size=5242880):
-    with open(image_path, 'rb') as img_file:
-        image_bytes = img_file.read()
-        if len(image_bytes) > max_size:
-            image = Image.open(image_path)
-            scale_factor = (max_size / len(image_bytes)) ** 0.5  # scale both width and height
-            new_width = int(image.width * scale_factor)
-            new_height = int(image.height * scale_factor)
-            resized_image = image.resize((new_width, new_height))
-            buffer = BytesIO()
-            resized_image.save(buffer, format="JPEG")
-            return buffer.getvalue()
-        else:
-            return image_bytes
-
-def main():
+    # Check the size on disk first; only images under the limit are read as raw bytes
+    file_size = os.path.getsize(image_path)
+    if file_size <= max_size:
+        with open(image_path, 'rb') as img_file:
+            return img_file.read()
+
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise IOError(f"Could not read image: {image_path}")
+    scale_factor = (max_size / file_size) ** 0.5  # scale both width and height
+    while True:
+        new_width = max(1, int(image.shape[1] * scale_factor))
+        new_height = max(1, int(image.shape[0] * scale_factor))
+        # INTER_AREA low-pass filters when shrinking, like PIL's antialiased resampling did
+        resized_image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        # Same JPEG quality PIL used by default; OpenCV would otherwise encode at 95
+        _, buffer = cv2.imencode('.jpg', resized_image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if len(buffer) <= max_size or (new_width == 1 and new_height == 1):
+            return buffer.tobytes()
+        # Still over the limit: shrink by the remaining byte ratio, with some margin
+        scale_factor *= 0.9 * (max_size / len(buffer)) ** 0.5
+
+def process_image(client, image_path, model_arn, pixel_threshold_min, pixel_threshold_max):
+    print(f"Processing image: {image_path}")
+
+    #read images as bytes
+    image_bytes = resize_image_if_needed(image_path)
+
+    # Detect custom labels
+    custom_labels = detect_custom_labels(client, model_arn, image_bytes)
+    detection_ok = custom_labels is not None
+
+    #extract bounding boxes
+    bounding_boxes = [
+        label['Geometry']['BoundingBox']
+        for label in custom_labels or []
+    ]
+
+    # Process pallets and sheets
+    pallets = process_pallets_and_sheets(image_path, bounding_boxes, pixel_threshold_min, pixel_threshold_max)
+    return pallets, detection_ok
+
+DETECTION_CACHE_DIR = '.cache'
+
+def detection_cache_path(image_paths, *params):
+    # Key on every file's path and mtime plus the detection parameters
+    key_source = repr((sorted((path, os.path.getmtime(path)) for path in image_paths), params))
+    key = hashlib.blake2b(key_source.encode(), digest_size=16).hexdigest()
+    return os.path.join(DETECTION_CACHE_DIR, f'{key}.json')
+
+def save_detection_cache(cache_path, pallets_per_image):
+    # Write to a temporary file first so an interrupted write never leaves a truncated cache
+    os.makedirs(DETECTION_CACHE_DIR, exist_ok=True)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(pallets_per_image, f)
+    os.replace(tmp_path, cache_path)
+
+def main(keep_running=False):
     project_arn='arn:aws:rekognition:eu-central-1:608495930675:project/DroneData/1745678300111'
     model_arn='arn:aws:rekognition:eu-central-1:608495930675:project/DroneData/version/DroneData.2025-04-26T17.05.36/1745679936041'
     min_inference_units=1 
     version_name='DroneData.2025-04-26T17.05.36'
 
-    #start AWS Rekognition model
-    start_model(project_arn, model_arn, version_name, min_inference_units)
-
     #Folder containing images
     image_folder = '/Users/iclal/Desktop/dev_data'
     pixel_threshold_min = 20
     pixel_threshold_max = 30
 
-    pallets_per_image = {}
-
-    #iterate through all images in the folder 
-    for image in os.listdir(image_folder):
-       if image.lower().endswith(('.png', '.jpg', '.jpeg')):
-        image_path = os.path.join(image_folder, image)
-        print(f"Processing image: {image_path}")
-
-        #read images as bytes
-        image_bytes = resize_image_if_needed(image_path)
-
-        # Detect custom labels
-        custom_labels = detect_custom_labels(rekognition_client, model_arn, image_bytes)
+    image_files = [
+        image for image in os.listdir(image_folder)
+        if image.lower().endswith(('.png', '.jpg', '.jpeg'))
+    ]
 
-        #extract bounding boxes
-        bounding_boxes = [
-            label['Geometry']['BoundingBox']
-            for label in custom_labels
-        ]
+    # Unchanged images with the same model and thresholds reuse earlier results
+    cache_path = detection_cache_path(
+        [os.path.join(image_folder, image) for image in image_files],
+        model_arn, pixel_threshold_min, pixel_threshold_max
+    )
+    if os.path.exists(cache_path):
+        print(f"Loading cached detections from {cache_path}")
+        with open(cache_path) as f:
+            return json.load(f)
 
-        # Process pallets and sheets
-        pallets = process_pallets_and_sheets(image_path, bounding_boxes, pixel_threshold_min, pixel_threshold_max)
+    # One client serves model start-up and all detection threads
+    client = get_rekognition_client()
 
-        pallets_per_image[image] = pallets
+    #start AWS Rekognition model, unless it is kept running between runs
+    if not keep_running:
+        start_model(client, project_arn, model_arn, version_name, min_inference_units)
 
-        # Output the results
-        print(f"Results for {image}:")
-        print(json.dumps(pallets, indent=4))
-
-        return pallets_per_image
+    pallets_per_image = {}
+    detection_failed = False
+
+    # Rekognition calls are network bound, so keep several in flight at once
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(process_image, client, os.path.join(image_folder, image), model_arn,
+                            pixel_threshold_min, pixel_threshold_max): image
+            for image in image_files
+        }
+        for future in as_completed(futures):
+            image = futures[future]
+            try:
+                pallets, detection_ok = future.result()
+            except Exception as e:
+                # Local errors like an unreadable file would recur on every run: record the image
+                # without pallets and keep the run cacheable (replacing the file changes the key)
+                print(f'❌ Error processing {image}:', e)
+                pallets, detection_ok = [], True
+            pallets_per_image[image] = pallets
+            detection_failed = detection_failed or not detection_ok
+
+            # Output the results
+            print(f"Results for {image}:")
+            print(json.dumps(pallets, indent=4))
+
+    # Restore directory listing order so downstream results don't depend on thread timing
+    pallets_per_image = {image: pallets_per_image[image] for image in image_files}
+
+    # Only cache complete runs; failed Rekognition calls must be retried next time
+    if detection_failed:
+        print('Some detections failed, results are not cached.')
+    else:
+        save_detection_cache(cache_path, pallets_per_image)
+
+    return pallets_per_image
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Detect pallets and barcode sheets with AWS Rekognition')
+    parser.add_argument('--keep-running', action='store_true',
+                        help='assume the Rekognition model is already running and skip starting it')
+    args = parser.parse_args()
+    main(keep_running=args.keep_running)
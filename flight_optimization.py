@@ -1,7 +1,66 @@
 import numpy as np
 import math
 import datetime
-import xml.dom.minidom as minidom
+from dataclasses import dataclass
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional, run the kernels as plain Python
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
+@dataclass
+class Trajectory:
+    """
+    Drone trajectory stored as parallel arrays, one row per waypoint.
+
+    Attributes:
+        positions: (N, 3) waypoint positions in local meters
+        orientations: (N, 3) roll, pitch, yaw in radians
+        times: (N,) arrival times in seconds
+        batteries: (N,) remaining battery in percentage
+        barcode_positions: (N, 3) scanned barcode positions, NaN for non-target waypoints
+        waypoint_types: 'start', 'intermediate' or 'target' per waypoint
+        palette_ids: Palette id per waypoint, None for non-target waypoints
+    """
+    positions: np.ndarray
+    orientations: np.ndarray
+    times: np.ndarray
+    batteries: np.ndarray
+    barcode_positions: np.ndarray
+    waypoint_types: list
+    palette_ids: list
+
+    def __len__(self):
+        return len(self.waypoint_types)
+
+    def to_dict_list(self):
+        """
+        Convert to a list of waypoint dictionaries with plain Python values, e.g. for JSON export.
+
+        Returns:
+            List of waypoints with position, orientation and timing
+        """
+        waypoints = []
+        for i, waypoint_type in enumerate(self.waypoint_types):
+            waypoint = {
+                'position': self.positions[i].tolist(),
+                'orientation': self.orientations[i].tolist(),
+                'waypoint_type': waypoint_type,
+                'time': float(self.times[i]),
+                'battery': float(self.batteries[i])
+            }
+            if waypoint_type == 'target':
+                waypoint['palette_id'] = self.palette_ids[i]
+                waypoint['barcode_position'] = self.barcode_positions[i].tolist()
+            waypoints.append(waypoint)
+        return waypoints
+
 
 def create_optimized_trajectory(barcode_positions, start_position=None, max_velocity=2.0, battery_capacity=100.0):
     """
@@ -14,29 +73,36 @@ def create_optimized_trajectory(barcode_positions, start_position=None, max_velo
         battery_capacity: Battery capacity in percentage
 
     Returns:
-        List of waypoints with position, orientation and timing
+        Trajectory with position, orientation and timing of every waypoint
     """
     # Use pre-calculated drone waypoints from triangulation
 
-    target_waypoints = []
-    for palette_id, data in barcode_positions.items():
-        barcode_pos = np.array(data['barcode_center'])
-        optimal_view_pos = np.array(data['drone_waypoint'])
+    # Stack all positions once; waypoints below hold row views into these arrays
+    palette_ids = list(barcode_positions)
+    barcode_array = np.array([data['barcode_center'] for data in barcode_positions.values()],
+                             dtype=np.float64).reshape(-1, 3)
+    view_array = np.array([data['drone_waypoint'] for data in barcode_positions.values()],
+                          dtype=np.float64).reshape(-1, 3)
 
-        # Calculate orientation: drone should face the barcode
-        view_direction = barcode_pos - optimal_view_pos
-        orientation = calculate_orientation(view_direction)
+    # Calculate orientation: drone should face the barcode
+    view_directions = barcode_array - view_array
 
-        target_waypoints.append({
-            'position': optimal_view_pos.tolist(),
-            'orientation': orientation,
+    target_waypoints = [
+        {
+            'position': optimal_view_pos,
+            'orientation': calculate_orientation(view_direction),
             'palette_id': palette_id,
-            'barcode_position': barcode_pos.tolist()
-        })
+            'barcode_position': barcode_pos
+        }
+        for palette_id, barcode_pos, optimal_view_pos, view_direction in zip(
+            palette_ids, barcode_array, view_array, view_directions
+        )
+    ]
 
     # Default start position if none provided
     if start_position is None:
         start_position = np.array([0, 0, 2.0])  # Default height of 2m
+    start_position = np.asarray(start_position, dtype=np.float64)
 
     # Use improved optimization technique (2-opt) instead of simple nearest neighbor
     optimized_order = optimize_waypoint_order_2opt(start_position, target_waypoints)
@@ -64,16 +130,17 @@ def calculate_orientation(direction_vector):
         List [roll, pitch, yaw] in radians
     """
     # Normalize direction vector
-    if np.linalg.norm(direction_vector) > 0:
-        direction = direction_vector / np.linalg.norm(direction_vector)
+    norm = np.linalg.norm(direction_vector)
+    if norm > 0:
+        dx, dy, dz = (direction_vector / norm).tolist()
     else:
         return [0, 0, 0]
 
     # Calculate yaw (rotation around z-axis)
-    yaw = np.arctan2(direction[1], direction[0])
+    yaw = math.atan2(dy, dx)
 
     # Calculate pitch (rotation around y-axis)
-    pitch = np.arctan2(-direction[2], np.sqrt(direction[0] ** 2 + direction[1] ** 2))
+    pitch = math.atan2(-dz, math.sqrt(dx ** 2 + dy ** 2))
 
     # Roll is typically kept at 0 for stable flight
     roll = 0
@@ -81,6 +148,78 @@ def calculate_orientation(direction_vector):
     return [roll, pitch, yaw]
 
 
+@njit(cache=True)
+def _two_opt_loops(D, tour):
+    """
+    Improve a tour in place with first-improvement 2-opt moves.
+
+    Args:
+        D: Pairwise distance matrix, float64 of shape (N, N)
+        tour: Visiting order as an int64 array of length N
+
+    Returns:
+        The improved tour array
+    """
+    n = tour.shape[0]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            for j in range(i + 2, n):
+                a, b = tour[i], tour[i + 1]
+                c, d = tour[j], tour[(j + 1) % n]
+
+                if D[a, c] + D[b, d] < D[a, b] + D[c, d]:
+                    # Reverse the subpath tour[i+1..j] to create 2-opt move
+                    lo, hi = i + 1, j
+                    while lo < hi:
+                        tour[lo], tour[hi] = tour[hi], tour[lo]
+                        lo += 1
+                        hi -= 1
+                    improved = True
+                    break
+            if improved:
+                break
+
+    return tour
+
+
+def _two_opt_vectorized(D, tour):
+    """
+    Same search as _two_opt_loops, but each candidate j range is tested with one NumPy expression.
+    Used when numba is not available, where scalar loops would run at Python speed.
+
+    Args:
+        D: Pairwise distance matrix, float64 of shape (N, N)
+        tour: Visiting order as an int64 array of length N
+
+    Returns:
+        The improved tour array
+    """
+    n = tour.shape[0]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            j = np.arange(i + 2, n)
+            a, b = tour[i], tour[i + 1]
+            c, d = tour[j], tour[(j + 1) % n]
+
+            better = D[a, c] + D[b, d] < D[a, b] + D[c, d]
+            if better.any():
+                # Apply the first improving move, like the loop version
+                j = i + 2 + int(np.argmax(better))
+                tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1].copy()
+                improved = True
+                break
+
+    return tour
+
+
+# Compiled scalar loops beat NumPy dispatch; without numba the vectorized search wins
+_two_opt = _two_opt_loops if HAVE_NUMBA else _two_opt_vectorized
+
+
 def optimize_waypoint_order_2opt(start_position, waypoints):
     """
     Use a 2-opt algorithm to solve the TSP problem
@@ -97,43 +236,28 @@ def optimize_waypoint_order_2opt(start_position, waypoints):
         return []
 
     # Extract positions into numpy arrays
-    positions = [np.array(wp['position']) for wp in waypoints]
+    positions = np.asarray([wp['position'] for wp in waypoints], dtype=np.float64)
+    n = len(positions)
+
+    # Pairwise distances are computed once and looked up from here on
+    D = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis=-1)
 
     # Initial solution using nearest neighbor
-    current_pos = start_position
-    unvisited = list(range(len(waypoints)))
+    dist_to_current = np.linalg.norm(positions - np.asarray(start_position), axis=1)
+    visited = np.zeros(n, dtype=bool)
     tour = []
 
-    while unvisited:
+    for _ in range(n):
         # Find nearest unvisited waypoint
-        nearest_idx = min(unvisited, key=lambda i: np.linalg.norm(positions[i] - current_pos))
+        nearest_idx = int(np.argmin(np.where(visited, np.inf, dist_to_current)))
         tour.append(nearest_idx)
-        current_pos = positions[nearest_idx]
-        unvisited.remove(nearest_idx)
+        visited[nearest_idx] = True
+        dist_to_current = D[nearest_idx]
 
     # Improve with 2-opt swaps
-    improved = True
-    while improved:
-        improved = False
-        for i in range(len(tour) - 2):
-            for j in range(i + 2, len(tour)):
-                # Calculate current distance
-                dist_current = (np.linalg.norm(positions[tour[i]] - positions[tour[i + 1]]) +
-                                np.linalg.norm(positions[tour[j]] - positions[tour[(j + 1) % len(tour)]]))
-
-                # Calculate distance if we swap
-                dist_new = (np.linalg.norm(positions[tour[i]] - positions[tour[j]]) +
-                            np.linalg.norm(positions[tour[i + 1]] - positions[tour[(j + 1) % len(tour)]]))
-
-                if dist_new < dist_current:
-                    # Reverse the subpath to create 2-opt move
-                    tour[i + 1:j + 1] = reversed(tour[i + 1:j + 1])
-                    improved = True
-                    break
-            if improved:
-                break
+    tour = _two_opt(np.ascontiguousarray(D), np.asarray(tour, dtype=np.int64))
 
-    return tour
+    return tour.tolist()
 
 
 def generate_complete_path(start_position, ordered_waypoints, max_velocity=2.0, battery_capacity=100.0):
@@ -148,64 +272,61 @@ def generate_complete_path(start_position, ordered_waypoints, max_velocity=2.0,
         battery_capacity: Battery capacity in percentage
 
     Returns:
-        Complete list of waypoints including intermediate points with timing
+        Trajectory including intermediate points with timing
     """
-    complete_path = []
-    current_pos = np.array(start_position) if isinstance(start_position, list) else start_position
+    current_pos = np.asarray(start_position, dtype=np.float64)
     current_time = 0.0
     battery_remaining = battery_capacity
     battery_drain_rate = 0.1  # % per meter
 
+    # Segment lengths determine how many intermediate points each leg gets
+    target_positions = np.asarray([wp['position'] for wp in ordered_waypoints], dtype=np.float64).reshape(-1, 3)
+    segment_starts = np.vstack([current_pos[None, :], target_positions])[:-1]
+    distances = np.linalg.norm(target_positions - segment_starts, axis=1)
+    num_points = np.where(distances > 2.0, np.maximum(1, (distances / 2.0).astype(np.int64)), 1)
+
+    # Every leg adds num_points - 1 intermediate points plus its target
+    total = 1 + int(num_points.sum())
+    positions = np.empty((total, 3), dtype=np.float64)
+    orientations = np.zeros((total, 3), dtype=np.float64)
+    times = np.empty(total, dtype=np.float64)
+    batteries = np.empty(total, dtype=np.float64)
+    barcode_positions = np.full((total, 3), np.nan, dtype=np.float64)
+    waypoint_types = ['intermediate'] * total
+    palette_ids = [None] * total
+
     # Add starting waypoint
-    complete_path.append({
-        'position': current_pos.tolist(),
-        'orientation': [0, 0, 0],
-        'waypoint_type': 'start',
-        'time': current_time,
-        'battery': battery_remaining
-    })
+    positions[0] = current_pos
+    times[0] = current_time
+    batteries[0] = battery_remaining
+    waypoint_types[0] = 'start'
+    k = 1
 
     # For each target waypoint, create direct path with intermediate points
-    for wp in ordered_waypoints:
-        target_pos = np.array(wp['position']) if isinstance(wp['position'], list) else wp['position']
-
+    for wp, target_pos, distance, n in zip(ordered_waypoints, target_positions, distances, num_points.tolist()):
         # Calculate direct path with intermediate points for smooth movement
         direction = target_pos - current_pos
-        distance = np.linalg.norm(direction)
 
         # Add intermediate points every 2 meters for smoother flight
         if distance > 2.0:
-            num_points = max(1, int(distance / 2.0))
-
-            # Generate intermediate waypoints
-            for i in range(1, num_points):
-                # Calculate position ratio along the path
-                ratio = i / num_points
-                intermediate_pos = current_pos + direction * ratio
-
-                # Calculate time to reach this point
-                segment_distance = distance * (1 / num_points)
-                segment_time = segment_distance / max_velocity
-                current_time += segment_time
-
-                # Calculate battery consumption
-                battery_drain = segment_distance * battery_drain_rate
-                battery_remaining -= battery_drain
-
-                # Calculate orientation towards the next point
-                intermediate_orientation = calculate_orientation(direction)
-
-                # Add intermediate waypoint
-                complete_path.append({
-                    'position': intermediate_pos.tolist(),
-                    'orientation': intermediate_orientation,
-                    'waypoint_type': 'intermediate',
-                    'time': current_time,
-                    'battery': battery_remaining
-                })
+            # Position, time and battery are linear along the segment: compute all at once
+            ratios = np.linspace(1 / n, (n - 1) / n, n - 1)
+            segment = slice(k, k + n - 1)
+            positions[segment] = current_pos + direction * ratios[:, None]
+            times[segment] = current_time + ratios * (distance / max_velocity)
+            batteries[segment] = battery_remaining - ratios * (distance * battery_drain_rate)
+
+            # Orientation towards the target is the same for the whole segment
+            orientations[segment] = calculate_orientation(direction)
+            k += n - 1
+
+            # Advance to the last intermediate point
+            covered_distance = distance * (n - 1) / n
+            current_time += covered_distance / max_velocity
+            battery_remaining -= covered_distance * battery_drain_rate
 
         # Add time for final approach
-        final_segment_distance = distance / num_points if distance > 2.0 else distance
+        final_segment_distance = distance / n if distance > 2.0 else distance
         current_time += final_segment_distance / max_velocity
 
         # Add time for barcode scanning operation
@@ -217,19 +338,26 @@ def generate_complete_path(start_position, ordered_waypoints, max_velocity=2.0,
         battery_remaining -= scan_time * 0.05  # Hovering battery drain
 
         # Add target waypoint
-        complete_path.append({
-            'position': wp['position'],
-            'orientation': wp['orientation'],
-            'palette_id': wp.get('palette_id', 'unknown'),
-            'waypoint_type': 'target',
-            'time': current_time,
-            'battery': battery_remaining,
-            'barcode_position': wp['barcode_position']
-        })
+        positions[k] = target_pos
+        orientations[k] = wp['orientation']
+        times[k] = current_time
+        batteries[k] = battery_remaining
+        barcode_positions[k] = wp['barcode_position']
+        waypoint_types[k] = 'target'
+        palette_ids[k] = wp.get('palette_id', 'unknown')
+        k += 1
 
         # Update current position for next iteration
         current_pos = target_pos
 
-    return complete_path
+    return Trajectory(
+        positions=positions,
+        orientations=orientations,
+        times=times,
+        batteries=batteries,
+        barcode_positions=barcode_positions,
+        waypoint_types=waypoint_types,
+        palette_ids=palette_ids
+    )
 
 
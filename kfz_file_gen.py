@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 # optimize_waypoint_order_2opt(), and generate_complete_path()
 
@@ -7,7 +8,7 @@ def generate_kml_waypoints(trajectory, origin_lat, origin_lon, origin_alt):
     Generate KML waypoint entries from trajectory data.
 
     Args:
-        trajectory: List of waypoints from create_optimized_trajectory
+        trajectory: Trajectory from create_optimized_trajectory
         origin_lat: Origin latitude in decimal degrees
         origin_lon: Origin longitude in decimal degrees
         origin_alt: Origin altitude in meters (ellipsoidal height)
@@ -19,20 +20,18 @@ def generate_kml_waypoints(trajectory, origin_lat, origin_lon, origin_alt):
     earth_radius = 6378137.0  # Earth radius in meters
     meters_per_lat = 111320.0  # Meters per degree latitude (approximate)
 
-    waypoint_xml_list = []
-
-    for wp in trajectory:
-        # Extract position
-        x, y, z = wp['position']
+    # Degrees per meter are constant for a fixed origin
+    lon_scale = 180.0 / (math.pi * earth_radius * math.cos(math.radians(origin_lat)))
+    lat_scale = 1.0 / meters_per_lat
 
-        # Convert local XYZ to lat/lon/alt
-        lon = origin_lon + (x / (earth_radius * math.cos(math.radians(origin_lat)))) * (180.0 / math.pi)
-        lat = origin_lat + (y / meters_per_lat)
+    # Convert all local XYZ positions to lon/lat/ellipsoidal height in one pass
+    positions = trajectory.positions
+    geo = positions * np.array([lon_scale, lat_scale, 1.0]) + np.array([origin_lon, origin_lat, origin_alt])
+    heights = positions[:, 2]  # Height above ground level
 
-        # Calculate height above ground and ellipsoidal height
-        ellipsoidal_height = origin_alt + z
-        height = z  # Height above ground level
+    waypoint_xml_list = []
 
+    for index, ((lon, lat, ellipsoidal_height), height) in enumerate(zip(geo.tolist(), heights.tolist())):
         # Create waypoint XML structure
         xml_string = f'''<Placemark>
   <Point>
@@ -40,7 +39,7 @@ def generate_kml_waypoints(trajectory, origin_lat, origin_lon, origin_alt):
       {lon:.9f},{lat:.9f}
     </coordinates>
   </Point>
-  <wpml:index>{wp.get('index', 0)}</wpml:index>
+  <wpml:index>{index}</wpml:index>
   <wpml:ellipsoidHeight>{ellipsoidal_height:.9f}</wpml:ellipsoidHeight>
   <wpml:height>{height:.1f}</wpml:height>
 </Placemark>'''
@@ -57,7 +56,7 @@ def insert_waypoints_in_kml(input_kml_path, output_kml_path, waypoint_xml_string
     Args:
         input_kml_path: Path to the input KML file
         output_kml_path: Path where the modified KML will be saved
-        waypoint_xml_strings: List of waypoint XML strings
+        waypoint_xml_strings: Iterable of waypoint XML strings
 
     Returns:
         Path to the modified KML file
@@ -73,17 +72,13 @@ def insert_waypoints_in_kml(input_kml_path, output_kml_path, waypoint_xml_string
     if insertion_marker in kml_content:
         pre_insertion, post_insertion = kml_content.split(insertion_marker, 1)
 
-        # Insert waypoints
-        waypoints_content = "\n  <!-- Drone Trajectory Waypoints -->\n"
-        for wp_xml in waypoint_xml_strings:
-            waypoints_content += "  " + wp_xml.replace("\n", "\n  ") + "\n"
-
-        # Combine everything
-        new_kml_content = pre_insertion + waypoints_content + insertion_marker + post_insertion
-
-        # Write the modified content to the output file
+        # Stream template and waypoints to the output file without building the full document
         with open(output_kml_path, 'w') as f:
-            f.write(new_kml_content)
+            f.write(pre_insertion)
+            f.write("\n  <!-- Drone Trajectory Waypoints -->\n")
+            f.writelines("  " + wp_xml.replace("\n", "\n  ") + "\n" for wp_xml in waypoint_xml_strings)
+            f.write(insertion_marker)
+            f.write(post_insertion)
 
         return output_kml_path
     else:
@@ -1,6 +1,7 @@
 import numpy as np
 import json
-import cv2
+import functools
+import math
 from detect_pallets_barcodes import main as bbox_pallet_barcode
 
 # Camera intrinsics (given/fixed)
@@ -8,23 +9,33 @@ K = np.array([
     [2804.051, 0, 2010.41],
     [0, 2804.051, 1512.734],
     [0, 0, 1]
-])
+], dtype=np.float64)
+K.setflags(write=False)  # shared constant: catch accidental in-place edits
 
 # --- Helper Functions ---
 
+METERS_PER_DEG_LAT = 111_320
+
+@functools.lru_cache(maxsize=32)
+def _meters_per_deg_lon(origin_lat):
+    """ Meters per degree of longitude at the origin latitude """
+    return 40075000.0 * math.cos(math.radians(origin_lat)) / 360.0
+
 def gps_to_local_xy(lat, lon, origin_lat, origin_lon):
-    """ Convert GPS to local meters (simple flat-earth approximation) """
-    meters_per_deg_lat = 111_320
-    meters_per_deg_lon = 40075000 * np.cos(np.radians(origin_lat)) / 360
-    dx = (lon - origin_lon) * meters_per_deg_lon
-    dy = (lat - origin_lat) * meters_per_deg_lat
+    """ Convert GPS to local meters (simple flat-earth approximation); lat/lon may be scalars or arrays """
+    dx = (np.asarray(lon) - origin_lon) * _meters_per_deg_lon(origin_lat)
+    dy = (np.asarray(lat) - origin_lat) * METERS_PER_DEG_LAT
     return dx, dy
 
-def extract_bbox_center(bbox):
-    """ Calculate center of bounding box in pixel coordinates """
-    center_x = bbox['pallet_left'] + bbox['pallet_width'] / 2
-    center_y = bbox['pallet_top'] + bbox['pallet_height'] / 2
-    return np.array([center_x, center_y])
+def extract_bbox_centers(bboxes):
+    """ Calculate centers of bounding boxes in pixel coordinates, returned as an (N, 2) array """
+    arr = np.asarray([
+        [bbox['pallet_left'], bbox['pallet_top'], bbox['pallet_width'], bbox['pallet_height']]
+        for bbox in bboxes
+    ], dtype=np.float64).reshape(-1, 4)
+    centers = arr[:, 2:4] * 0.5
+    centers += arr[:, 0:2]
+    return centers
 
 def build_pose(x, y, z):
     """ Build 4x4 pose matrix (identity rotation assumed) """
@@ -32,93 +43,165 @@ def build_pose(x, y, z):
     pose[:3, 3] = [x, y, z]
     return pose
 
-def triangulate(K, pose1, pose2, pts1, pts2):
-    """ Triangulate corresponding points between two views """
-    P1 = K @ pose1[:3, :4]
-    P2 = K @ pose2[:3, :4]
-    pts4d = cv2.triangulatePoints(P1, P2, pts1.T, pts2.T)
-    pts3d = (pts4d / pts4d[3])[:3].T
+def projection_matrix(K, pose):
+    """ Build 3x4 camera projection matrix from intrinsics and a 4x4 pose """
+    return K @ pose[:3, :4]
+
+def triangulate(P1, P2, pts1, pts2):
+    """ Triangulate corresponding points between two views given their projection matrices """
+    # Linear (DLT) triangulation: one 4x4 system per point, solved as a batch.
+    # Rows are written straight into one contiguous buffer instead of stacking temporaries.
+    A = np.empty((len(pts1), 4, 4), dtype=np.float64)
+    np.subtract(pts1[:, 0:1] * P1[2], P1[0], out=A[:, 0])
+    np.subtract(pts1[:, 1:2] * P1[2], P1[1], out=A[:, 1])
+    np.subtract(pts2[:, 0:1] * P2[2], P2[0], out=A[:, 2])
+    np.subtract(pts2[:, 1:2] * P2[2], P2[1], out=A[:, 3])
+    _, _, vh = np.linalg.svd(A)
+    pts4d = vh[:, -1, :]
+    pts3d = pts4d[:, :3] / pts4d[:, 3:]
     return pts3d
 
-def fit_plane(points):
-    """ Fit a plane to 3D points, return (normal vector, centroid) """
+def fit_plane(points, method='eigh'):
+    """ Fit a plane to 3D points, return (normal vector, centroid); method is 'eigh' (3x3 covariance) or 'svd' """
     centroid = np.mean(points, axis=0)
+    # Fewer than 3 points leave the plane undefined: face the camera axis
+    if len(points) < 3:
+        return np.array([0., 0., 1.]), centroid
     centered = points - centroid
-    _, _, vh = np.linalg.svd(centered)
-    normal = vh[-1]
-    return normal, centroid
 
-# --- Main Function ---
-pallets_detection = bbox_pallet_barcode()
-
-def compute_barcode_positions(pallets_detection):
+    # Variances along the principal axes, ascending; reuse them to detect collinear points
+    tol = len(points) * np.finfo(np.float64).eps
+    if method == 'svd':
+        _, s, vh = np.linalg.svd(centered, full_matrices=False)
+        w = s[::-1] ** 2
+        normal = vh[-1]
+    else:
+        # Eigenvalues come back ascending: the first eigenvector is the least-variance direction
+        w, v = np.linalg.eigh(centered.T @ centered)
+        normal = v[:, 0]
+
+    # Collinear (or coincident) points span no plane either
+    if w[1] <= tol * w[2]:
+        return np.array([0., 0., 1.]), centroid
+    return normal, centroid
 
-    barcode_positions = []
+# --- Pipeline ---
 
-    for image_name, pallets in pallets_detection.items():
-        for pallet in pallets:
-            sheet = pallet.get('sheet_detected')
-            if sheet is not None:
-                # Compute barcode center
-                center_x = sheet['sheet_left'] + sheet['sheet_width'] / 2
-                center_y = sheet['sheet_top'] + sheet['sheet_height'] / 2
+SHEET_DTYPE = np.dtype([
+    ('image_name', object),
+    ('pallet_index', np.int32),
+    ('sheet_left', np.float64),
+    ('sheet_top', np.float64),
+    ('sheet_width', np.float64),
+    ('sheet_height', np.float64),
+])
 
-                barcode_info = {
-                    'image_name': image_name,
-                    'pallet_index': pallet['pallet_index'],
-                    'barcode_center_x': center_x,
-                    'barcode_center_y': center_y
-                }
+BARCODE_DTYPE = np.dtype([
+    ('image_name', object),
+    ('pallet_index', np.int32),
+    ('barcode_center_x', np.float64),
+    ('barcode_center_y', np.float64),
+])
 
-                barcode_positions.append(barcode_info)
+def compute_barcode_positions(pallets_detection):
+    """ Compute barcode centers of all detected sheets, returned as a BARCODE_DTYPE structured array """
+
+    # Flatten to the pallets that carry a sheet, then fill an exactly sized array
+    detected = [
+        (image_name, pallet['pallet_index'], pallet['sheet_detected'])
+        for image_name, pallets in pallets_detection.items()
+        for pallet in pallets
+        if pallet.get('sheet_detected') is not None
+    ]
+    sheets = np.fromiter(
+        ((image_name, pallet_index,
+          sheet['sheet_left'], sheet['sheet_top'], sheet['sheet_width'], sheet['sheet_height'])
+         for image_name, pallet_index, sheet in detected),
+        dtype=SHEET_DTYPE, count=len(detected)
+    )
+
+    # Compute barcode centers for all sheets at once
+    barcode_positions = np.empty(len(sheets), dtype=BARCODE_DTYPE)
+    barcode_positions['image_name'] = sheets['image_name']
+    barcode_positions['pallet_index'] = sheets['pallet_index']
+    barcode_positions['barcode_center_x'] = sheets['sheet_left'] + 0.5 * sheets['sheet_width']
+    barcode_positions['barcode_center_y'] = sheets['sheet_top'] + 0.5 * sheets['sheet_height']
 
     return barcode_positions
 
-barcode_positions = compute_barcode_positions(pallets_detection)
+METADATA_DTYPE = np.dtype([
+    ('focal_length', np.float64),  # in mm
+    ('latitude', np.float64),
+    ('longitude', np.float64),
+    ('altitude', np.float64),
+    ('image_width', np.float64),
+    ('image_height', np.float64),
+])
 
 def triangulate_barcodes(barcode_positions, metadata_per_image):
-    barcode_world_positions = []
-
-    for barcode in barcode_positions:
-        image_name = barcode['image_name']
-        center_x = barcode['barcode_center_x']
-        center_y = barcode['barcode_center_y']
-
-        metadata = metadata_per_image.get(image_name)
-        if metadata is None:
-            print(f"No metadata for {image_name}, skipping...")
-            continue
-
-        focal_length = metadata['focal_length']  # in mm
-        latitude = metadata['latitude']
-        longitude = metadata['longitude']
-        altitude = metadata['altitude']  # you might need this!
-
-        # Example: normalize pixel to optical center (you might need calibration)
-        # Assume principal point is at image center, and pixel size known
-        optical_center_x = metadata['image_width'] / 2
-        optical_center_y = metadata['image_height'] / 2
-
-        normalized_x = (center_x - optical_center_x) / focal_length
-        normalized_y = (center_y - optical_center_y) / focal_length
-
-        # For a rough triangulation:
-        # Assume drone is facing straight down (nadir view),
-        # and we approximate 3D X,Y shift based on altitude and normalized image coordinates.
-
-        real_world_x = longitude + normalized_x * altitude  # Simplified
-        real_world_y = latitude + normalized_y * altitude
-        real_world_z = altitude
-
-        barcode_world_positions.append({
-            'pallet_index': barcode['pallet_index'],
-            'barcode_world_x': real_world_x,
-            'barcode_world_y': real_world_y,
-            'barcode_world_z': real_world_z,
-        })
+    # Gather metadata of every referenced image once into a structured array
+    image_names = [name for name in dict.fromkeys(barcode_positions['image_name'].tolist())
+                   if metadata_per_image.get(name) is not None]
+    name_to_idx = {name: i for i, name in enumerate(image_names)}
+    meta = np.array([
+        tuple(metadata_per_image[name][field] for field in METADATA_DTYPE.names)
+        for name in image_names
+    ], dtype=METADATA_DTYPE)
+
+    idx = np.fromiter((name_to_idx.get(name, -1) for name in barcode_positions['image_name']),
+                      dtype=np.int64, count=len(barcode_positions))
+    missing = idx < 0
+    for image_name in dict.fromkeys(barcode_positions['image_name'][missing].tolist()):
+        print(f"No metadata for {image_name}, skipping...")
+    barcodes = barcode_positions[~missing]
+    meta = meta[idx[~missing]]
+
+    focal_length = meta['focal_length']
+
+    # Example: normalize pixel to optical center (you might need calibration)
+    # Assume principal point is at image center, and pixel size known
+    optical_center_x = meta['image_width'] / 2
+    optical_center_y = meta['image_height'] / 2
+
+    normalized_x = (barcodes['barcode_center_x'] - optical_center_x) / focal_length
+    normalized_y = (barcodes['barcode_center_y'] - optical_center_y) / focal_length
+
+    # For a rough triangulation:
+    # Assume drone is facing straight down (nadir view),
+    # and we approximate 3D X,Y shift based on altitude and normalized image coordinates.
+
+    real_world_x = meta['longitude'] + normalized_x * meta['altitude']  # Simplified
+    real_world_y = meta['latitude'] + normalized_y * meta['altitude']
+    real_world_z = meta['altitude']
+
+    barcode_world_positions = [
+        {
+            'pallet_index': pallet_index,
+            'barcode_world_x': world_x,
+            'barcode_world_y': world_y,
+            'barcode_world_z': world_z,
+        }
+        for pallet_index, world_x, world_y, world_z in zip(
+            barcodes['pallet_index'].tolist(), real_world_x.tolist(),
+            real_world_y.tolist(), real_world_z.tolist()
+        )
+    ]
 
     return barcode_world_positions
 
+# --- Main Function ---
+
+def main(metadata_per_image=None):
+    """ Run detection and compute barcode positions; triangulate them when image metadata is given """
+    pallets_detection = bbox_pallet_barcode()
+    barcode_positions = compute_barcode_positions(pallets_detection)
+    if metadata_per_image is None:
+        return barcode_positions
+    return triangulate_barcodes(barcode_positions, metadata_per_image)
+
+if __name__ == '__main__':
+    main()
+
 # # --- Example Usage ---
 #
 # # Example metadata and bounding boxes